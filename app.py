@@ -1,13 +1,27 @@
 import io
+import os
+import numpy as np
 import pandas as pd
 import streamlit as st
 import html
 import re
 
-st.set_page_config(page_title="Materials Search", layout="wide")
+try:
+    import orjson as _json  # C実装のJSONパーサ（あれば2〜4倍速い）
+except ImportError:  # pragma: no cover - 環境依存
+    import json as _json
+
+# pandas 2.x では copy-on-write を明示的に有効化（3.0以降は常に有効なので不要）
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+# URLの<a>化パターン（呼び出しごとの再コンパイルを避けるためモジュールレベルで1回だけ）
+_URL_RE = re.compile(r"(https?://[\w\-./%?#=&]+)")
+_URL_REPL = r"<a href='\1' target='_blank' rel='noopener'>\1</a>"
+
 # ---- Top bar Back link (no JS; works inside iframe via target="_top") ----
-st.markdown(
-    """
+# モジュール定数として1回だけ構築（スクリプト本文での三重引用文字列の再構築を避ける）
+_TOPBAR_HTML = """
     <style>
       .app-topbar{position:sticky; top:0; z-index:9999; background:#ffffffcc; backdrop-filter: blur(4px); padding:8px 0 6px; margin-bottom:4px; border-bottom:1px solid #eee;}
       .app-topbar__inner{display:flex; align-items:center; gap:8px;}
@@ -19,20 +33,113 @@ st.markdown(
         <a class="app-topbar__btn" href="https://www.info-shop.info/applist" target="_top" rel="noopener">← Back</a>
       </div>
     </div>
-    """,
-    unsafe_allow_html=True,
-)
+    """
+
+st.set_page_config(page_title="Materials Search", layout="wide")
+st.markdown(_TOPBAR_HTML, unsafe_allow_html=True)
 st.title("Materials Search（Ver1.0）")
 
+# ---- リッチテキスト → HTML 変換器（表示する1行にだけ遅延適用する） ----
+def _autolink(text: str) -> str:
+    # URLを<a>化
+    return _URL_RE.sub(_URL_REPL, text)
+
+def rich_to_html(val: object) -> str:
+    if val is None or (isinstance(val, float) and pd.isna(val)):
+        return ""
+    s = str(val).strip()
+    if not s:
+        return ""
+    # Wix/Editor風 JSON（nodes を持つ）をテキスト化
+    if s.startswith("{") and '"nodes"' in s:
+        try:
+            doc = _json.loads(s)
+            parts = []
+            for node in doc.get("nodes", []):
+                if isinstance(node, dict) and node.get("type") == "PARAGRAPH":
+                    texts = []
+                    for t in node.get("nodes", []):
+                        if isinstance(t, dict) and t.get("type") == "TEXT":
+                            td = t.get("textData", {})
+                            txt = td.get("text", "")
+                            url = None
+                            for d in td.get("decorations", []) or []:
+                                if d.get("type") == "LINK":
+                                    url = d.get("linkData", {}).get("link", {}).get("url")
+                            if url:
+                                texts.append(f"<a href='{html.escape(url)}' target='_blank' rel='noopener'>{html.escape(txt or url)}</a>")
+                            else:
+                                texts.append(html.escape(txt))
+                    parts.append("<p>" + "".join(texts) + "</p>")
+            return "".join(parts)
+        except Exception:
+            # JSONとして扱えなければ通常処理へフォールバック
+            pass
+    # 既にHTMLっぽいならそのまま
+    if "<" in s and ">" in s:
+        return s
+    # プレーンテキスト → エスケープ＆リンク化＆改行変換
+    s = html.escape(s)
+    s = _autolink(s)
+    return s.replace("\n", "<br>")
+
 # ====== データ読み込み ======
-@st.cache_data
-def load_materials(file_bytes: bytes | None) -> pd.DataFrame:
+# 列名の同義語マップ（正規化後の小文字名、左が優先）
+ALIASES = {
+    "lambda": ["λ", "valuea", "lambda(w/mk)", "lam", "thermal_conductivity"],
+    "name": ["material", "材料", "素材", "name_ja", "material_name", "品名", "名称"],
+    "category": ["カテゴリ", "カテゴリー", "分類", "category_name", "group", "種別"],
+    "evidence": ["standarda", "standard_a"],
+    "document_raw": ["ドキュメント", "document", "doc"],
+}
+
+# 実際に使う列（正規化後の名前）。それ以外はパースせず捨てる
+_INTERESTING_COLS = (
+    {"category", "name", "lambda", "evidence", "comment", "コメント"}
+    | set(ALIASES)
+    | {a for cands in ALIASES.values() for a in cands}
+)
+
+def _csv_stat(path: str = "material_db.csv") -> tuple[float, int]:
+    """CSVの(mtime, size)。キャッシュキーに混ぜて、ファイル更新時だけ再読込させる"""
     try:
+        stt = os.stat(path)
+        return (stt.st_mtime, stt.st_size)
+    except OSError:
+        return (0.0, 0)
+
+@st.cache_data(persist="disk", show_spinner=False, max_entries=8)
+def load_materials(file_bytes: bytes | None, csv_stat: tuple[float, int] = (0.0, 0)) -> pd.DataFrame:
+    try:
+        # PyArrow エンジンはマルチスレッドの単一パースで高速（使えない環境ではC engineへ）
+        def read_csv_fast(src):
+            # ヘッダだけ先読みし、使う列だけを usecols でパースする（dtype推論も残る列だけ）
+            kw = {}
+            try:
+                header_cols = pd.read_csv(src, nrows=0).columns
+                if hasattr(src, "seek"):
+                    src.seek(0)
+                usecols = [c for c in header_cols if str(c).strip().lower() in _INTERESTING_COLS]
+                if usecols:
+                    # dtype は指定しない：λ列に数値化できないセルが1つでもあると
+                    # read_csv ごと失敗して全件空になる。数値化は後段の to_numeric
+                    # (errors="coerce") に任せ、不正セルはその行のNaNに留める
+                    kw = {"usecols": usecols}
+            except Exception:
+                if hasattr(src, "seek"):
+                    src.seek(0)
+            try:
+                return pd.read_csv(src, engine="pyarrow", **kw)
+            except Exception:
+                if hasattr(src, "seek"):
+                    src.seek(0)
+                return pd.read_csv(src, **kw)
+
         if file_bytes:
-            df = pd.read_csv(io.BytesIO(file_bytes))
+            df = read_csv_fast(io.BytesIO(file_bytes))
         else:
             try:
-                df = pd.read_csv("material_db.csv")
+                df = read_csv_fast("material_db.csv")
             except Exception:
                 df = None
         if df is None:
@@ -41,48 +148,15 @@ def load_materials(file_bytes: bytes | None) -> pd.DataFrame:
         # 列名を正規化
         df = df.rename(columns={c: str(c).strip().lower() for c in df.columns})
         
-        # 重複列名にも対応して、最初に有効な値を返すSeriesを取得
-        def pick_series(dframe: pd.DataFrame, names: list[str]):
-            try:
-                for n in names:
-                    if n in dframe.columns:
-                        # 同名の重複列をすべて取得して左から優先
-                        sub = dframe.loc[:, dframe.columns == n]
-                        if isinstance(sub, pd.DataFrame):
-                            if sub.shape[1] == 1:
-                                return sub.iloc[:, 0]
-                            # 行方向で左→右に値を補完して先頭列を採用
-                            return sub.bfill(axis=1).iloc[:, 0]
-                        else:
-                            return dframe[n]
-                return None
-            except Exception:
-                return None
-        
-        # 同義列の吸収
-        # lambda
-        if "lambda" not in df.columns:
-            for alt in ["λ", "valuea", "lambda(w/mk)", "lam", "thermal_conductivity"]:
-                if alt in df.columns:
-                    df["lambda"] = df[alt]
-                    break
-        # name
-        if "name" not in df.columns:
-            for alt in ["material", "材料", "素材", "name_ja", "material_name", "品名", "名称"]:
-                if alt in df.columns:
-                    df["name"] = df[alt]
-                    break
-        # category
-        if "category" not in df.columns:
-            for alt in ["カテゴリ", "カテゴリー", "分類", "category_name", "group", "種別"]:
-                if alt in df.columns:
-                    df["category"] = df[alt]
-                    break
-        # evidence (standarda)
-        if "evidence" not in df.columns:
-            s = pick_series(df, ["standarda", "standard_a"])
-            if s is not None:
-                df["evidence"] = s
+        # 同義列の吸収：候補列をまとめて取り出し、bfillで左優先に値を採用
+        # （重複列名があっても df[present] が全列を返すので1パスで対応できる）
+        for key, cands in ALIASES.items():
+            if key in df.columns:
+                continue
+            present = [c for c in cands if c in df.columns]
+            if present:
+                sub = df[present]
+                df[key] = sub.bfill(axis=1).iloc[:, 0] if sub.shape[1] > 1 else sub.iloc[:, 0]
         if "evidence" not in df.columns:
             df["evidence"] = ""
 
@@ -93,64 +167,19 @@ def load_materials(file_bytes: bytes | None) -> pd.DataFrame:
             df["comment"] = df["comment"].astype(str)
 
         # ドキュメント列（JSONリッチテキスト/HTML想定）を補助入力として扱う
-        doc_series = pick_series(df, ["ドキュメント", "document", "doc"])
-        if doc_series is not None:
-            df["document_raw"] = doc_series.astype(str) if hasattr(doc_series, "astype") else str(doc_series)
+        if "document_raw" in df.columns:
+            df["document_raw"] = df["document_raw"].astype(str)
         else:
             df["document_raw"] = ""
 
-        # ---- リッチテキスト → HTML 変換器 ----
-        def _autolink(text: str) -> str:
-            # URLを<a>化
-            return re.sub(r"(https?://[\w\-./%?#=&]+)", r"<a href='\1' target='_blank' rel='noopener'>\1</a>", text)
-
-        def rich_to_html(val: object) -> str:
-            if val is None or (isinstance(val, float) and pd.isna(val)):
-                return ""
-            s = str(val).strip()
-            if not s:
-                return ""
-            # Wix/Editor風 JSON（nodes を持つ）をテキスト化
-            if s.startswith("{") and '"nodes"' in s:
-                try:
-                    import json as _json
-                    doc = _json.loads(s)
-                    parts = []
-                    for node in doc.get("nodes", []):
-                        if isinstance(node, dict) and node.get("type") == "PARAGRAPH":
-                            texts = []
-                            for t in node.get("nodes", []):
-                                if isinstance(t, dict) and t.get("type") == "TEXT":
-                                    td = t.get("textData", {})
-                                    txt = td.get("text", "")
-                                    url = None
-                                    for d in td.get("decorations", []) or []:
-                                        if d.get("type") == "LINK":
-                                            url = d.get("linkData", {}).get("link", {}).get("url")
-                                    if url:
-                                        texts.append(f"<a href='{html.escape(url)}' target='_blank' rel='noopener'>{html.escape(txt or url)}</a>")
-                                    else:
-                                        texts.append(html.escape(txt))
-                            parts.append("<p>" + "".join(texts) + "</p>")
-                    return "".join(parts)
-                except Exception:
-                    # JSONとして扱えなければ通常処理へフォールバック
-                    pass
-            # 既にHTMLっぽいならそのまま
-            if "<" in s and ">" in s:
-                return s
-            # プレーンテキスト → エスケープ＆リンク化＆改行変換
-            s = html.escape(s)
-            s = _autolink(s)
-            return s.replace("\n", "<br>")
-
-        # コメント本文：commentが空ならdocument_rawを使う
-        base_text = df["comment"].astype(str)
+        # コメント本文：commentが空ならdocument_rawを使う（欠損は空文字に正規化）
+        # HTMLへの変換はここでは行わない。表示されるのは選択された1行だけなので、
+        # rich_to_html は表示時に遅延実行する（全行変換はロード時間の無駄）
+        base_text = df["comment"].astype(str).fillna("")
         needs_fallback = base_text.str.strip().eq("")
-        base_text = base_text.where(~needs_fallback, df["document_raw"])  # 空ならドキュメントで補完
-
-        # HTMLへ変換（以降、comment列はHTMLとして扱う）
-        df["comment"] = base_text.map(rich_to_html)
+        base_text = base_text.where(~needs_fallback, df["document_raw"]).fillna("")  # 空ならドキュメントで補完
+        df["comment"] = base_text.str.strip()
+        del df["document_raw"]  # 取り込み済みなので早めに解放
 
         # 必須列の確保
         for c in ["category","name","lambda","evidence","comment"]:
@@ -165,75 +194,119 @@ def load_materials(file_bytes: bytes | None) -> pd.DataFrame:
         df["comment"] = df["comment"].astype(str)
 
         # 最低限の列にする
-        return df[["category","name","lambda","evidence","comment"]].dropna(subset=["name"]).reset_index(drop=True)
-        
+        df = df[["category","name","lambda","evidence","comment"]].dropna(subset=["name"]).reset_index(drop=True)
+
+        # category/name は重複が多いので categorical 化（メモリ削減＆比較高速化）
+        df["category"] = df["category"].astype("category")
+        df["name"] = df["name"].astype("category")
+
+        # キーワード検索用に小文字化した name/category を1列に融合して事前計算
+        # （検索時の走査が2パス→1パスになる。改行はキーワードに現れないので区切りに安全）
+        df["_search_lc"] = (
+            df["name"].astype(str).str.lower() + "\n" + df["category"].astype(str).str.lower()
+        )
+
+        # メモリ削減：lambdaはfloat32で十分、自由文字列列はArrowバックエンドに
+        # （str.contains が Arrow のC++カーネルにディスパッチされる）
+        df["lambda"] = df["lambda"].astype("float32")
+        try:
+            for c in ["evidence", "comment", "_search_lc"]:
+                df[c] = df[c].astype("string[pyarrow]")
+        except Exception:
+            pass
+        # 多数の列操作で断片化したブロックを統合してからキャッシュに載せる
+        return df.copy()
+
     except Exception as e:
         st.error(f"データ読み込みエラー: {e}")
         # エラーが発生した場合は空のDataFrameを返す
-        return pd.DataFrame(columns=["category","name","lambda","evidence","comment"])
+        return pd.DataFrame(columns=["category","name","lambda","evidence","comment","_search_lc"])
 
 # ====== サイドバー：入力 ======
 st.sidebar.header("データと検索条件")
-materials = load_materials(None)
+materials = load_materials(None, _csv_stat())
 
 st.sidebar.caption(f"材料件数: {len(materials)}")
 
 # 検索条件
-cat_options = ["(すべて)"] + sorted([c for c in materials["category"].dropna().unique().tolist() if str(c).strip() != ""]) 
-sel_cat = st.sidebar.selectbox("カテゴリ", options=cat_options, index=0)
+@st.cache_data(show_spinner=False)
+def category_options(materials: pd.DataFrame) -> list[str]:
+    # categorical なら辞書（カテゴリ一覧）から直接取れる。unique() の再走査は不要
+    cats = materials["category"]
+    if isinstance(cats.dtype, pd.CategoricalDtype):
+        vals = cats.cat.categories.tolist()
+    else:
+        vals = cats.dropna().unique().tolist()
+    return ["(すべて)"] + sorted([c for c in vals if c.strip() != ""])
+
+cat_options = category_options(materials)
 
-kw = st.sidebar.text_input("材料名キーワード（部分一致）", value="")
+# フォームでまとめて送信（キーストロークごとの再実行を防ぐ）
+with st.sidebar.form("filters"):
+    sel_cat = st.selectbox("カテゴリ", options=cat_options, index=0)
+    kw = st.text_input("材料名キーワード（部分一致）", value="")
+    sort_col = st.selectbox("並び替え列", ["name","category","lambda"], index=0)
+    sort_asc = st.checkbox("昇順", value=True)
+    st.form_submit_button("適用")
 
-sort_col = st.sidebar.selectbox("並び替え列", ["name","category","lambda"], index=0)
-sort_asc = st.sidebar.checkbox("昇順", value=True)
+# ====== フィルタ（検索条件が同じ再実行ではキャッシュを返す） ======
+@st.cache_data(show_spinner=False, max_entries=32)
+def filter_view(materials: pd.DataFrame, sel_cat: str, kw: str, sort_col: str, sort_asc: bool) -> pd.DataFrame:
+    # コピーせず単一のブールマスクを合成し、スライスは最後に1回だけ
+    mask = np.ones(len(materials), dtype=bool)
+    if sel_cat != "(すべて)":
+        mask &= (materials["category"] == sel_cat).to_numpy()
+    if kw.strip():
+        s = kw.strip().lower()
+        mask &= materials["_search_lc"].str.contains(s, regex=False, na=False).to_numpy()
+    view = materials.loc[mask]
 
-# ====== フィルタ適用 ======
-view = materials.copy()
-if sel_cat != "(すべて)":
-    view = view[view["category"].astype(str) == str(sel_cat)]
-if kw.strip():
-    s = kw.strip().lower()
-    name_hit = view["name"].astype(str).str.lower().str.contains(s, na=False)
-    cat_hit = view["category"].astype(str).str.lower().str.contains(s, na=False)
-    view = view[name_hit | cat_hit]
+    # 並び替え（安定性は不要なのでquicksort、reset_indexの代わりにignore_index）
+    return view.sort_values(by=sort_col, ascending=sort_asc, kind="quicksort", na_position="last", ignore_index=True)
 
-# 並び替え
-view = view.sort_values(by=sort_col, ascending=sort_asc, kind="mergesort").reset_index(drop=True)
+# 表示列のスキーマは固定なので column_config は1回だけ構築する
+_COLUMN_CONFIG = {
+    "lambda": st.column_config.NumberColumn("lambda (W/mK)", format="%.3f"),
+}
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def view_to_csv_bytes(view: pd.DataFrame) -> bytes:
+    # ダウンロード用CSV。キャッシュするので再実行のたびに再シリアライズしない
+    return view[["category", "name", "lambda", "evidence"]].to_csv(index=False).encode("utf-8-sig")
 
 # ====== 結果表示 ======
-st.subheader("検索結果")
-st.caption("列：category / name / lambda (W/mK) / evidence")
-
-# ---- リッチテキスト対応のHTMLテーブル描画 ----
-# 安全のため、comment以外はHTMLエスケープし、commentはそのまま挿入して装飾を生かす
-cols = ["category","name","lambda","evidence"]
-view_disp = view[cols] if all(c in view.columns for c in cols) else view
-
-# シンプルなスタイル
-table_css = """
-<style>
-.materials-table {width: 100%; border-collapse: collapse;}
-.materials-table th, .materials-table td {border: 1px solid #ddd; padding: 8px; vertical-align: top;}
-.materials-table th {background: #f6f6f6; position: sticky; top: 0; z-index: 1;}
-.materials-table td pre {margin: 0; white-space: pre-wrap;}
-.wrap {word-break: break-word;}
-</style>
-"""
-
-headers = ["category", "name", "lambda (W/mK)", "evidence"]
-rows_html = []
-for _, r in view_disp.iterrows():
-    cat = html.escape(str(r.get("category", "")))
-    name = html.escape(str(r.get("name", "")))
-    lam = r.get("lambda", "")
-    lam_str = "" if pd.isna(lam) else html.escape(f"{lam}")
-    evd = html.escape(str(r.get("evidence", "")))
-    rows_html.append(
-        f"<tr>\n<td class='wrap'>{cat}</td>\n<td class='wrap'>{name}</td>\n<td>{lam_str}</td>\n<td class='wrap'>{evd}</td>\n</tr>"
+@st.fragment
+def render_results(materials: pd.DataFrame, sel_cat: str, kw: str, sort_col: str, sort_asc: bool) -> None:
+    st.subheader("検索結果")
+    st.caption("列：category / name / lambda (W/mK) / evidence")
+    view = filter_view(materials, sel_cat, kw, sort_col, sort_asc)
+
+    # HTML文字列を組み立てる代わりにArrowシリアライズで転送（バイト数も組み立てコストも小さい）
+    st.dataframe(
+        view[["category", "name", "lambda", "evidence"]],
+        use_container_width=True,
+        hide_index=True,
+        column_config=_COLUMN_CONFIG,
+    )
+
+    # 検索結果のエクスポート（バイト列を直接渡す。base64埋め込みのdata URIは使わない）
+    st.download_button(
+        "結果をCSVでダウンロード",
+        data=view_to_csv_bytes(view),
+        file_name="materials_search.csv",
+        mime="text/csv",
     )
 
-table_html = table_css + "<table class='materials-table'>" \
-    + "<thead><tr>" + "".join(f"<th>{html.escape(h)}</th>" for h in headers) + "</tr></thead>" \
-    + "<tbody>" + "".join(rows_html) + "</tbody></table>"
+    # ---- 行の詳細（コメント）----
+    # HTML変換は選択された1行にだけ遅延適用する（全行変換はしない）
+    if len(view):
+        with st.expander("材料の詳細（コメント）"):
+            sel_i = st.selectbox(
+                "材料を選択",
+                options=range(len(view)),
+                format_func=lambda i: f"{view['category'].iloc[i]} / {view['name'].iloc[i]}",
+            )
+            detail_html = rich_to_html(view["comment"].iloc[sel_i])
+            st.markdown(detail_html or "（コメントなし）", unsafe_allow_html=True)
 
-st.markdown(table_html, unsafe_allow_html=True)
\ No newline at end of file
+render_results(materials, sel_cat, kw, sort_col, sort_asc)
\ No newline at end of file